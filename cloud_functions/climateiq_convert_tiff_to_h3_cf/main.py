@@ -0,0 +1,191 @@
+"""Cloud functions which convert GeoTIFF rasters to H3-aggregated CSV files.
+
+Each raster pixel is sampled at several points, each sample is assigned to an
+H3 cell and per-cell mean values are written out as a CSV file. Two entry
+points are provided: a batch function which converts every TIFF in the input
+bucket and an event-driven function which converts a single newly uploaded
+TIFF.
+"""
+
+import io
+import multiprocessing
+import os
+
+from cloudevents import http
+import functions_framework
+from google.cloud import storage
+# The numpy_int API returns H3 indexes as unsigned integers, which keeps the
+# sampled cells in a numpy array instead of a list of hex strings.
+import h3.api.numpy_int as h3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+import rasterio
+from rasterio.io import MemoryFile
+
+INPUT_BUCKET_NAME = "climateiq-heat-rasters"
+OUTPUT_BUCKET_NAME = "climateiq-heat-h3"
+H3_RESOLUTION = 10
+NUM_SAMPLES_PER_PIXEL_SIDE = 5
+FEET_TO_METERS = 0.3048
+
+
+def assign_pixels_to_h3(
+    pixels_df: pd.DataFrame, profile: dict, resolution: int = H3_RESOLUTION
+) -> tuple[np.ndarray, np.ndarray]:
+    """Assigns sampled points within each pixel to H3 cells.
+
+    Each pixel is covered by an evenly spaced grid of
+    NUM_SAMPLES_PER_PIXEL_SIDE**2 sample points, built by broadcasting the
+    per-pixel sample offsets over every pixel at once.
+
+    Args:
+        pixels_df: A DataFrame with "latitude", "longitude" and "value"
+            columns, one row per raster pixel.
+        profile: The rasterio profile of the source raster.
+        resolution: The H3 resolution to assign cells at.
+
+    Returns:
+        A tuple of (H3 cells, values) arrays, one entry per sample point.
+    """
+    transform = profile["transform"]
+    pixel_size_x = transform.a
+    pixel_size_y = -transform.e
+    num_samples = NUM_SAMPLES_PER_PIXEL_SIDE
+
+    lat_offsets = -np.arange(num_samples) * pixel_size_y / num_samples
+    lon_offsets = np.arange(num_samples) * pixel_size_x / num_samples
+    sample_lats, sample_lons = np.broadcast_arrays(
+        pixels_df["latitude"].to_numpy()[:, None, None] + lat_offsets[:, None],
+        pixels_df["longitude"].to_numpy()[:, None, None] + lon_offsets[None, :],
+    )
+    cells = np.fromiter(
+        (
+            h3.geo_to_h3(lat, lon, resolution)
+            for lat, lon in zip(sample_lats.ravel(), sample_lons.ravel())
+        ),
+        dtype=np.uint64,
+        count=sample_lats.size,
+    )
+    values = np.repeat(pixels_df["value"].to_numpy(), num_samples * num_samples)
+    return cells, values
+
+
+def _convert_raster_to_h3_csv(src: rasterio.DatasetReader) -> bytes:
+    """Converts one open GeoTIFF dataset to H3-aggregated CSV bytes.
+
+    The raster is streamed window by window along its native block layout,
+    so peak memory is bounded by the block size rather than the full band.
+    Per-cell partial sums and counts from each window are merged before the
+    means are taken, since a cell's samples can span several windows.
+    """
+    window_cells = []
+    window_sums = []
+    window_counts = []
+    nodata = src.nodata
+    profile = src.profile
+    for _, window in src.block_windows(1):
+        data = src.read(1, window=window)
+        # data == data is False exactly for NaN, and the in-place &= drops
+        # one temporary mask allocation per window.
+        valid = data == data
+        valid &= data != nodata
+        if not valid.any():
+            continue
+        # Apply the window's affine transform to every pixel center at
+        # once instead of looping over rows and columns in Python,
+        # with the six coefficients unpacked into plain float locals.
+        a, b, c, d, e, f = src.window_transform(window)[:6]
+        cols, rows = np.meshgrid(
+            np.arange(data.shape[1]), np.arange(data.shape[0])
+        )
+        col_centers = cols + 0.5
+        row_centers = rows + 0.5
+        xs = a * col_centers + b * row_centers + c
+        ys = d * col_centers + e * row_centers + f
+        pixels_df = pd.DataFrame(
+            {
+                "latitude": ys[valid],
+                "longitude": xs[valid],
+                # Raster values are in feet; H3 outputs are published in
+                # meters. Converting here touches each pixel once rather
+                # than every sample-expanded copy.
+                "value": data[valid] * FEET_TO_METERS,
+            }
+        )
+
+        cells, values = assign_pixels_to_h3(pixels_df, profile)
+        unique_cells, inverse = np.unique(cells, return_inverse=True)
+        window_cells.append(unique_cells)
+        window_sums.append(np.bincount(inverse, weights=values))
+        window_counts.append(np.bincount(inverse))
+
+    if window_cells:
+        # Per-cell means via bincount over integer keys, matching groupby's
+        # sorted-by-cell output without materializing a sample DataFrame.
+        unique_cells, inverse = np.unique(
+            np.concatenate(window_cells), return_inverse=True
+        )
+        sums = np.bincount(inverse, weights=np.concatenate(window_sums))
+        counts = np.bincount(inverse, weights=np.concatenate(window_counts))
+        means = sums / counts
+    else:
+        unique_cells, means = np.array([], dtype=np.uint64), np.array([])
+    # Cells are aggregated as integers; the published CSV keeps hex codes.
+    # pyarrow's CSV writer serializes the columns natively rather than via
+    # pandas' per-row Python formatter.
+    h3_aggregated = pa.table(
+        {
+            "cell_code": [h3.h3_to_string(cell) for cell in unique_cells],
+            "value": means,
+        }
+    )
+    buffer = io.BytesIO()
+    pa_csv.write_csv(h3_aggregated, buffer)
+    return buffer.getvalue()
+
+
+def _convert_one_blob(object_name: str) -> None:
+    """Downloads, converts and re-uploads a single TIFF blob.
+
+    Builds its own storage client so it is safe to run inside a pool
+    worker, where connections from the parent process do not survive the
+    fork. The TIFF and CSV both stay in memory; nothing round-trips
+    through /tmp.
+    """
+    storage_client = storage.Client()
+    blob = storage_client.bucket(INPUT_BUCKET_NAME).blob(object_name)
+    with MemoryFile(blob.download_as_bytes()) as memory_file:
+        with memory_file.open() as src:
+            csv_bytes = _convert_raster_to_h3_csv(src)
+    output_blob = storage_client.bucket(OUTPUT_BUCKET_NAME).blob(
+        object_name.replace(".tif", ".csv")
+    )
+    output_blob.upload_from_string(csv_bytes)
+
+
+@functions_framework.http
+def convert_tiff_to_h3(request) -> str:
+    """Batch entry point which converts every TIFF in the input bucket."""
+    storage_client = storage.Client()
+    tiff_names = [
+        blob.name
+        for blob in storage_client.list_blobs(INPUT_BUCKET_NAME)
+        if blob.name.endswith(".tif")
+    ]
+    # Rasters are independent, so convert them on all available cores.
+    if tiff_names:
+        workers = min(os.cpu_count() or 1, len(tiff_names))
+        with multiprocessing.Pool(workers) as pool:
+            pool.map(_convert_one_blob, tiff_names)
+    return f"Converted {len(tiff_names)} files."
+
+
+@functions_framework.cloud_event
+def convert_tiff_to_h3_csv(cloud_event: http.CloudEvent) -> None:
+    """Event-driven entry point which converts a single uploaded TIFF."""
+    object_name = cloud_event.data["name"]
+    if not object_name.endswith(".tif"):
+        return
+    _convert_one_blob(object_name)
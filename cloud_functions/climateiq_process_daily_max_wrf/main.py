@@ -0,0 +1,255 @@
+"""Cloud function which reduces hourly WRF output to daily maxima.
+
+For each day of hourly WRF NetCDF files this function computes the daily
+maximum 2m temperature, the relative humidity at the hour of that maximum and
+the corresponding NWS heat index, then writes one daily NetCDF file to the
+output bucket.
+"""
+
+import collections
+import re
+
+import functions_framework
+import gcsfs
+from google.cloud import storage
+from netCDF4 import Dataset
+import numpy as np
+import wrf
+
+GCP_PROJECT = "climateiq"
+INPUT_BUCKET_NAME = "climateiq-wrf-hourly"
+OUTPUT_BUCKET_NAME = "climateiq-wrf-daily-max"
+KELVIN_OFFSET = 273.15
+# Matches the "_YYYY-MM-DD_" date portion of hourly WRF file names.
+_DATE_PATTERN = re.compile(r"_(\d{4}-\d{2}-\d{2})_")
+
+# Clients are created lazily and cached for the lifetime of the function
+# instance, so warm invocations skip the auth and connection setup each
+# client constructor performs.
+_storage_client = None
+_gcs_fs = None
+
+
+def _get_storage_client() -> storage.Client:
+    """Returns a storage client shared across warm invocations."""
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def _get_gcs_fs() -> gcsfs.GCSFileSystem:
+    """Returns a GCS filesystem shared across warm invocations."""
+    global _gcs_fs
+    if _gcs_fs is None:
+        _gcs_fs = gcsfs.GCSFileSystem(project=GCP_PROJECT)
+    return _gcs_fs
+
+
+@functions_framework.http
+def process_daily_max_wrf(request) -> str:
+    """Entry point which processes every day in the requested date ranges."""
+    params = request.get_json(silent=True) or {}
+    date_ranges = params["date_ranges"]
+
+    client = _get_storage_client()
+    all_files = [blob.name for blob in client.list_blobs(INPUT_BUCKET_NAME)]
+    files_in_range = list_files_within_date_ranges(all_files, date_ranges)
+    files_by_day = organize_files_by_day(files_in_range)
+
+    for day, day_files in files_by_day.items():
+        process_day_files(day, sorted(day_files), INPUT_BUCKET_NAME)
+    return f"Processed {len(files_by_day)} days."
+
+
+def list_files_within_date_ranges(
+    files: list[str], date_ranges: list[tuple[str, str]]
+) -> list[str]:
+    """Filters WRF file names to those within the given date ranges.
+
+    Args:
+        files: WRF file names containing a "_YYYY-MM-DD_HH:MM:SS" timestamp.
+        date_ranges: (start, end) date strings in "YYYY-MM-DD" format,
+            inclusive.
+
+    Returns:
+        The file names whose timestamps fall within any of the ranges.
+    """
+    files_in_range = []
+    for file in files:
+        match = _DATE_PATTERN.search(file.rsplit("/", 1)[-1])
+        if match is None:
+            continue
+        file_date = match.group(1)
+        # Zero-padded ISO dates order lexicographically like calendar
+        # dates, so the bounds never need to round-trip through strptime.
+        if any(start <= file_date <= end for start, end in date_ranges):
+            files_in_range.append(file)
+    return files_in_range
+
+
+def organize_files_by_day(files_in_range: list[str]) -> dict[str, list[str]]:
+    """Groups WRF file names by their date string."""
+    files_by_day = collections.defaultdict(list)
+    for file in files_in_range:
+        match = _DATE_PATTERN.search(file.rsplit("/", 1)[-1])
+        if match is not None:
+            files_by_day[match.group(1)].append(file)
+    return files_by_day
+
+
+def compute_heat_index(
+    temperature_f: np.ndarray, relative_humidity: np.ndarray
+) -> np.ndarray:
+    """Computes the NWS heat index for a whole grid at once.
+
+    Uses the Rothfusz regression with the standard NWS adjustments, falling
+    back to the simple formula below 80F. Every branch is evaluated
+    elementwise and blended with masks, so no Python-level per-cell loop is
+    needed.
+
+    Args:
+        temperature_f: The air temperatures in degrees Fahrenheit.
+        relative_humidity: The relative humidities in percent.
+
+    Returns:
+        The heat index grid in degrees Fahrenheit.
+    """
+    t = np.asarray(temperature_f, dtype=float)
+    rh = np.asarray(relative_humidity, dtype=float)
+    simple_hi = 0.5 * (t + 61.0 + ((t - 68.0) * 1.2) + (rh * 0.094))
+
+    hi = (
+        -42.379
+        + 2.04901523 * t
+        + 10.14333127 * rh
+        - 0.22475541 * t * rh
+        - 0.00683783 * t * t
+        - 0.05481717 * rh * rh
+        + 0.00122874 * t * t * rh
+        + 0.00085282 * t * rh * rh
+        - 0.00000199 * t * t * rh * rh
+    )
+    in_range = (t >= 80) & (t <= 112)
+    low_rh = (rh < 13) & in_range
+    # The sqrt argument is non-negative wherever low_rh holds; clip keeps
+    # the discarded lanes from raising invalid-value warnings.
+    low_rh_adjustment = ((13 - rh) / 4) * np.sqrt(
+        np.clip((17 - np.abs(t - 95)) / 17, 0, None)
+    )
+    high_rh = (rh > 85) & (t >= 80) & (t <= 87)
+    high_rh_adjustment = ((rh - 85) / 10) * ((87 - t) / 5)
+    hi = np.where(low_rh, hi - low_rh_adjustment, hi)
+    hi = np.where(high_rh, hi + high_rh_adjustment, hi)
+    return np.where(simple_hi < 80, simple_hi, hi)
+
+
+def get_max_values_and_hi(
+    t2_data: np.ndarray, rh2_data: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Computes daily max temperature and the matching heat index.
+
+    Args:
+        t2_data: Hourly 2m temperature grids in Kelvin, stacked along the
+            first axis.
+        rh2_data: Hourly relative humidity grids in percent, stacked along
+            the first axis.
+
+    Returns:
+        A tuple of (daily max temperature in Kelvin, heat index in
+        Fahrenheit), both 2D grids.
+    """
+    # asarray is a no-op for the preallocated stacks built by
+    # process_day_files but keeps list-of-grid callers working.
+    t2_array = np.asarray(t2_data)
+    rh2_array = np.asarray(rh2_data)
+
+    # One argmax pass over the stack locates the hottest hour; the maxima
+    # themselves and the matching humidities are then cheap gathers, instead
+    # of scanning the stack a second time with a separate max reduction.
+    max_hour = np.argmax(t2_array, axis=0)
+    max_t2 = np.take_along_axis(t2_array, max_hour[np.newaxis], axis=0)[0]
+    corresponding_rh = np.take_along_axis(rh2_array, max_hour[np.newaxis], axis=0)[0]
+
+    max_temp_fahrenheit = (max_t2 - KELVIN_OFFSET) * 9 / 5 + 32
+    heat_index = compute_heat_index(max_temp_fahrenheit, corresponding_rh)
+    return max_t2, heat_index
+
+
+def process_day_files(day: str, day_files: list[str], bucket_name: str) -> None:
+    """Reduces one day of hourly WRF files to daily maxima and saves them.
+
+    Args:
+        day: The date string of the day being processed.
+        day_files: The hourly WRF file names for the day.
+        bucket_name: The bucket containing the hourly files.
+    """
+    fs = _get_gcs_fs()
+    t2_data = None
+    rh2_data = None
+    for hour_index, file in enumerate(day_files):
+        nc = Dataset("in_memory", memory=fs.cat(f"{bucket_name}/{file}"))
+        t2 = wrf.getvar(nc, "T2", meta=False)
+        if t2_data is None:
+            # The grid shape is only known once the first file is open;
+            # preallocating the full day's stacks then lets every later
+            # hour be written straight into its slice, instead of growing
+            # Python lists that np.array would re-copy into a fresh block.
+            t2_data = np.empty((len(day_files),) + t2.shape, dtype=t2.dtype)
+            rh2_data = np.empty_like(t2_data)
+        t2_data[hour_index] = t2
+        rh2_data[hour_index] = wrf.getvar(nc, "rh2", meta=False)
+        # The first hour doubles as the output template, so its handle
+        # stays open rather than being re-downloaded by save_to_netcdf.
+        if hour_index == 0:
+            template_nc = nc
+        else:
+            nc.close()
+
+    max_t2, heat_index = get_max_values_and_hi(t2_data, rh2_data)
+    try:
+        save_to_netcdf(day, max_t2, heat_index, template_nc)
+    finally:
+        template_nc.close()
+
+
+def save_to_netcdf(
+    day: str,
+    max_t2: np.ndarray,
+    heat_index: np.ndarray,
+    template_nc: Dataset,
+) -> None:
+    """Writes daily maxima to a NetCDF file modeled on an hourly template.
+
+    Args:
+        day: The date string of the day being written.
+        max_t2: The daily max 2m temperature grid in Kelvin.
+        heat_index: The heat index grid in Fahrenheit.
+        template_nc: An open hourly WRF dataset whose dimensions and
+            coordinate variables are copied to the output. The caller
+            keeps ownership of the handle.
+    """
+    # Writing with memory= keeps the file diskless; close() then hands back
+    # the serialized bytes, so nothing round-trips through /tmp.
+    out_nc = Dataset(f"daily_max_{day}.nc", "w", format="NETCDF4", memory=1024)
+    for name, dimension in template_nc.dimensions.items():
+        out_nc.createDimension(
+            name, len(dimension) if not dimension.isunlimited() else None
+        )
+    for name in ("XLAT", "XLONG"):
+        variable = template_nc.variables[name]
+        # The static coordinate grids carry no fill values, so skipping
+        # masked-array reconstruction copies them as plain arrays.
+        variable.set_auto_mask(False)
+        out_var = out_nc.createVariable(name, variable.datatype, variable.dimensions)
+        out_var[:] = variable[:]
+
+    t2_var = out_nc.createVariable("T2_MAX", "f4", ("Time", "south_north", "west_east"))
+    t2_var[0, :, :] = max_t2
+    hi_var = out_nc.createVariable("HI_MAX", "f4", ("Time", "south_north", "west_east"))
+    hi_var[0, :, :] = heat_index
+    nc_bytes = out_nc.close()
+
+    client = _get_storage_client()
+    bucket = client.bucket(OUTPUT_BUCKET_NAME)
+    bucket.blob(f"daily_max_{day}.nc").upload_from_string(bytes(nc_bytes))
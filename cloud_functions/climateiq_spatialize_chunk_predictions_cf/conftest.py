@@ -0,0 +1,73 @@
+"""Shared fixtures for the spatialize chunk predictions tests."""
+
+import types
+from unittest import mock
+
+from google.cloud import firestore
+from google.cloud import storage
+import pytest
+
+import main
+
+# Autospeccing the storage client class walks its full class hierarchy via
+# inspect, so the spec mock is built once per process and shared by every
+# test rather than rebuilt per test.
+_STORAGE_CLIENT_MOCK = mock.create_autospec(storage.Client, instance=True)
+
+
+class _FakeDocumentSnapshot:
+    """Lightweight stand-in for a Firestore document snapshot."""
+
+    def __init__(self):
+        self.exists = True
+        self.metadata = None
+
+    def to_dict(self):
+        return self.metadata
+
+
+class _FakeFirestoreClient:
+    """Hand-rolled double covering the two document reads main performs.
+
+    A MagicMock chain allocates a fresh child mock for every attribute
+    access and call along collection().document().get(); this double
+    builds the whole reference tree once and resolves every hop with a
+    keyed dict lookup, so bad collection or document names fail loudly.
+    """
+
+    def __init__(self):
+        self.study_area = _FakeDocumentSnapshot()
+        self.chunk = _FakeDocumentSnapshot()
+        chunks_ref = types.SimpleNamespace(
+            document={"chunk-id": types.SimpleNamespace(get=lambda: self.chunk)}.get
+        )
+        study_area_ref = types.SimpleNamespace(
+            get=lambda: self.study_area,
+            collection={main.CHUNKS_ID: chunks_ref}.get,
+        )
+        self.collection = {
+            main.STUDY_AREAS_ID: types.SimpleNamespace(
+                document={"study-area-name": study_area_ref}.get
+            )
+        }.get
+
+
+@pytest.fixture(autouse=True)
+def mock_clients(monkeypatch):
+    """Patches the GCP client classes and yields the shared instance mocks.
+
+    Tests receive a namespace with the storage and firestore instance mocks
+    and mutate only the attributes under test; the mocks and the clients
+    cached by main are reset between tests.
+    """
+    main._firestore_client = None
+    main._storage_client = None
+    main._study_area_cache.clear()
+    main._chunk_metadata_cache.clear()
+    _STORAGE_CLIENT_MOCK.reset_mock(return_value=True, side_effect=True)
+    fake_firestore = _FakeFirestoreClient()
+    monkeypatch.setattr(storage, "Client", lambda *args, **kwargs: _STORAGE_CLIENT_MOCK)
+    monkeypatch.setattr(firestore, "Client", lambda *args, **kwargs: fake_firestore)
+    return types.SimpleNamespace(
+        storage=_STORAGE_CLIENT_MOCK, firestore=fake_firestore
+    )
@@ -0,0 +1,611 @@
+"""Cloud function which spatializes model predictions for a single chunk.
+
+Triggered by a Pub/Sub message containing the GCS object name of a chunk
+prediction file. The predictions are projected onto H3 cells, merged with
+overlapping predictions from the chunk's neighbors and written out as a
+Parquet file keyed by H3 index.
+"""
+
+import base64
+import concurrent.futures
+import functools
+import io
+import pathlib
+
+from cloudevents import http
+from google.cloud import firestore
+from google.cloud import storage
+# The numpy_int API returns H3 indexes as 64-bit ints rather than hex
+# strings, so the h3_index column stays numpy-backed (8 bytes per cell) and
+# isin/groupby hash machine ints instead of Python strings.
+import h3.api.numpy_int as h3
+import numpy as np
+import orjson
+import pandas as pd
+import pyproj
+import shapely
+from shapely import geometry
+
+GLOBAL_CRS = "EPSG:4326"
+# Note: H3 resolution 13 has an average cell area of ~43 m^2.
+H3_LEVEL = 13
+# Circumradius of an H3 cell at H3_LEVEL (equal to its edge length), used to
+# bound how far an H3 cell can reach across a chunk edge.
+H3_MAX_RADIUS_METERS = h3.edge_length(H3_LEVEL, unit="m")
+STUDY_AREAS_ID = "study_areas"
+CHUNKS_ID = "chunks"
+CLIMATEIQ_PREDICTIONS_BUCKET = "climateiq-predictions"
+CLIMATEIQ_SPATIALIZED_PREDICTIONS_BUCKET = "climateiq-spatialized-predictions"
+
+# Clients are created lazily and cached for the lifetime of the function
+# instance, so warm invocations skip the auth and metadata discovery each
+# client constructor performs.
+_firestore_client = None
+_storage_client = None
+
+# Study area and chunk metadata are written once when a study area is
+# onboarded, so validated lookups are likewise cached for the lifetime of
+# the instance and warm invocations skip the Firestore round trips.
+_study_area_cache: dict = {}
+_chunk_metadata_cache: dict = {}
+
+
+def _get_firestore_client() -> firestore.Client:
+    """Returns a Firestore client shared across warm invocations."""
+    global _firestore_client
+    if _firestore_client is None:
+        _firestore_client = firestore.Client()
+    return _firestore_client
+
+
+def _get_storage_client() -> storage.Client:
+    """Returns a storage client shared across warm invocations."""
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def subscribe(cloud_event: http.CloudEvent) -> None:
+    """Entry point which spatializes the model predictions for one chunk.
+
+    Args:
+        cloud_event: The Pub/Sub message describing the chunk prediction
+            file. The base64-encoded message data is the GCS object name of
+            the file, in the format
+            "<id>/<prediction_type>/<model_id>/<study_area_name>/<scenario_id>/<chunk_id>".
+    """
+    object_name = base64.b64decode(cloud_event.data["message"]["data"]).decode()
+    path = pathlib.PurePosixPath(object_name)
+    if len(path.parts) != 6:
+        print(
+            "Invalid object name format. Expected format: "
+            '"<id>/<prediction_type>/<model_id>/<study_area_name>/'
+            '<scenario_id>/<chunk_id>" '
+            f'Actual name: "{object_name}"'
+        )
+        return
+    *_, study_area_name, _, chunk_id = path.parts
+
+    db = _get_firestore_client()
+    try:
+        study_area_metadata, chunks_ref = _get_study_area_metadata(db, study_area_name)
+        chunk_metadata = _get_chunk_metadata(chunks_ref, study_area_name, chunk_id)
+        # Index the in-memory chunks map by grid coordinate once so neighbor
+        # lookups below need no further Firestore round trips.
+        chunks_by_coord = {
+            (chunk.get("x_index"), chunk.get("y_index")): (neighbor_chunk_id, chunk)
+            for neighbor_chunk_id, chunk in study_area_metadata["chunks"].items()
+        }
+        h3_predictions = _aggregate_h3_predictions(
+            study_area_metadata, chunk_metadata, chunks_by_coord, chunk_id, object_name
+        )
+    except ValueError as error:
+        print(error)
+        return
+
+    bucket = _get_storage_client().bucket(CLIMATEIQ_SPATIALIZED_PREDICTIONS_BUCKET)
+    blob = bucket.blob(f"{object_name}.parquet")
+    # Serialize in memory and upload in one shot rather than streaming rows
+    # through the GCS file wrapper. Parquet with snappy compression writes
+    # far fewer bytes than CSV and stores the int64 H3 indexes natively.
+    buffer = io.BytesIO()
+    h3_predictions.to_frame().to_parquet(
+        buffer, compression="snappy", engine="pyarrow"
+    )
+    blob.upload_from_string(
+        buffer.getvalue(), content_type="application/octet-stream"
+    )
+
+
+def _get_study_area_metadata(
+    db: firestore.Client,
+    study_area_name: str,
+) -> tuple[dict, firestore.CollectionReference]:
+    """Retrieves metadata for the given study area from Firestore.
+
+    Args:
+        db: The Firestore client.
+        study_area_name: The name of the study area to retrieve metadata for.
+
+    Returns:
+        A tuple of the study area metadata dict and a reference to the study
+        area's chunks collection.
+
+    Raises:
+        ValueError: If the study area does not exist or its metadata is
+            missing required fields.
+    """
+    cached = _study_area_cache.get(study_area_name)
+    if cached is not None:
+        return cached
+
+    study_area_ref = db.collection(STUDY_AREAS_ID).document(study_area_name)
+    study_area_doc = study_area_ref.get()
+    if not study_area_doc.exists:
+        raise ValueError(f'Study area "{study_area_name}" does not exist')
+
+    study_area_metadata = study_area_doc.to_dict()
+    if not _study_area_metadata_fields_valid(study_area_metadata):
+        raise ValueError(
+            f'Study area "{study_area_name}" is missing one or more required '
+            "fields: cell_size, crs, chunks, row_count, col_count"
+        )
+
+    chunks_ref = study_area_ref.collection(CHUNKS_ID)
+    _study_area_cache[study_area_name] = (study_area_metadata, chunks_ref)
+    return study_area_metadata, chunks_ref
+
+
+def _get_chunk_metadata(
+    chunks_ref: firestore.CollectionReference,
+    study_area_name: str,
+    chunk_id: str,
+) -> dict:
+    """Retrieves metadata for the given chunk from Firestore.
+
+    Args:
+        chunks_ref: A reference to the study area's chunks collection.
+        study_area_name: The name of the study area the chunk belongs to.
+        chunk_id: The id of the chunk to retrieve metadata for.
+
+    Returns:
+        The chunk metadata dict.
+
+    Raises:
+        ValueError: If the chunk does not exist or its metadata is missing
+            required fields.
+    """
+    cached = _chunk_metadata_cache.get((study_area_name, chunk_id))
+    if cached is not None:
+        return cached
+
+    chunk_doc = chunks_ref.document(chunk_id).get()
+    if not chunk_doc.exists:
+        raise ValueError(f'Chunk "{chunk_id}" does not exist')
+    chunk_metadata = chunk_doc.to_dict()
+    if not _chunk_metadata_fields_valid(chunk_metadata):
+        raise ValueError(
+            f'Chunk "{chunk_id}" is missing one or more required fields: '
+            "row_count, col_count, x_ll_corner, y_ll_corner, x_index, y_index"
+        )
+    _chunk_metadata_cache[(study_area_name, chunk_id)] = chunk_metadata
+    return chunk_metadata
+
+
+@functools.lru_cache(maxsize=8)
+def _get_transformer(src_crs: str) -> pyproj.Transformer:
+    """Returns a cached transformer from the given CRS to the global CRS.
+
+    Building a PROJ transformation pipeline requires a PROJ database lookup,
+    so the transformer is cached per source CRS and shared by every chunk
+    processed by a (warm) function instance.
+    """
+    return pyproj.Transformer.from_crs(src_crs, GLOBAL_CRS, always_xy=True)
+
+
+def _study_area_metadata_fields_valid(study_area_metadata: dict) -> bool:
+    """Returns whether the study area metadata contains all required fields."""
+    return all(
+        field in study_area_metadata
+        for field in ("cell_size", "crs", "chunks", "row_count", "col_count")
+    )
+
+
+def _chunk_metadata_fields_valid(chunk_metadata: dict) -> bool:
+    """Returns whether the chunk metadata contains all required fields."""
+    return all(
+        field in chunk_metadata
+        for field in (
+            "row_count",
+            "col_count",
+            "x_ll_corner",
+            "y_ll_corner",
+            "x_index",
+            "y_index",
+        )
+    )
+
+
+def _read_chunk_predictions(object_name: str) -> np.ndarray:
+    """Reads model predictions for one chunk from GCS.
+
+    Args:
+        object_name: The name of the chunk prediction file.
+
+    Returns:
+        A 2D array of model predictions for the chunk.
+
+    Raises:
+        ValueError: If the predictions file is empty or contains more than
+            one prediction row.
+    """
+    bucket = _get_storage_client().bucket(CLIMATEIQ_PREDICTIONS_BUCKET)
+    blob = bucket.blob(object_name)
+    # Download in a single GET and parse with orjson rather than iterating
+    # the GCS file wrapper line by line through the stdlib parser.
+    lines = blob.download_as_bytes().splitlines()
+    if not lines:
+        raise ValueError(f'Predictions file "{object_name}" is missing predictions')
+    if len(lines) > 1:
+        raise ValueError(f'Predictions file "{object_name}" has too many predictions')
+
+    # float32 is ample precision for model output and halves the memory and
+    # bandwidth of every downstream step.
+    return np.asarray(orjson.loads(lines[0])["prediction"], dtype=np.float32)
+
+
+def _read_neighbor_chunk_predictions(
+    object_name: str, neighbor_chunk_id: str
+) -> np.ndarray:
+    """Reads model predictions for a neighbor of the current chunk.
+
+    Args:
+        object_name: The name of the current chunk's prediction file.
+        neighbor_chunk_id: The id of the neighbor chunk to read.
+
+    Returns:
+        A 2D array of model predictions for the neighbor chunk.
+
+    Raises:
+        ValueError: If the neighbor chunk's predictions file is missing or
+            invalid.
+    """
+    path = pathlib.PurePosixPath(object_name)
+    neighbor_object_name = str(path.parent / neighbor_chunk_id)
+    return _read_chunk_predictions(neighbor_object_name)
+
+
+def _build_spatialized_model_predictions(
+    study_area_metadata: dict, chunk_metadata: dict, predictions: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Projects model predictions onto global lat/lon coordinates.
+
+    Each prediction is associated with the centroid of the grid cell it was
+    generated for, then reprojected from the study area's CRS to the global
+    CRS.
+
+    Args:
+        study_area_metadata: Metadata for the study area.
+        chunk_metadata: Metadata for the chunk the predictions cover.
+        predictions: A 2D array of model predictions, with row 0 at the top
+            (northernmost) edge of the chunk.
+
+    Returns:
+        A tuple of flat (lats, lons, predictions) arrays, one entry per
+        grid cell.
+    """
+    cell_size = study_area_metadata["cell_size"]
+    rows = np.arange(chunk_metadata["row_count"])
+    cols = np.arange(chunk_metadata["col_count"])
+    x_centers = chunk_metadata["x_ll_corner"] + (cols + 0.5) * cell_size
+    # The y centers are generated top-down to match the prediction row
+    # order, so the predictions align without a flip-and-copy pass.
+    y_centers = chunk_metadata["y_ll_corner"] + (rows[::-1] + 0.5) * cell_size
+    xx, yy = np.meshgrid(x_centers, y_centers)
+
+    transformer = _get_transformer(study_area_metadata["crs"])
+    lons, lats = transformer.transform(xx.ravel(), yy.ravel())
+
+    return np.asarray(lats), np.asarray(lons), predictions.ravel()
+
+
+def _neighbor_boundary_strip(
+    chunk_metadata: dict,
+    neighbor_metadata: dict,
+    study_area_metadata: dict,
+    predictions: np.ndarray,
+) -> tuple[dict, np.ndarray]:
+    """Slices a neighbor chunk down to the strip bordering the current chunk.
+
+    By construction only H3 cells within one cell radius of the shared edge
+    can overlap the current chunk, so spatializing more than a thin strip of
+    the neighbor's predictions is wasted work.
+
+    Args:
+        chunk_metadata: Metadata for the current chunk.
+        neighbor_metadata: Metadata for the neighbor chunk.
+        study_area_metadata: Metadata for the study area.
+        predictions: The neighbor's 2D prediction array, row 0 at the top.
+
+    Returns:
+        A tuple of (adjusted neighbor metadata, sliced prediction array)
+        covering only the boundary strip.
+    """
+    cell_size = study_area_metadata["cell_size"]
+    strip_cells = int(H3_MAX_RADIUS_METERS / cell_size) + 1
+    dx = neighbor_metadata["x_index"] - chunk_metadata["x_index"]
+    dy = neighbor_metadata["y_index"] - chunk_metadata["y_index"]
+
+    strip_metadata = dict(neighbor_metadata)
+    row_count = neighbor_metadata["row_count"]
+    col_count = neighbor_metadata["col_count"]
+
+    if dx < 0 and col_count > strip_cells:
+        # Neighbor to the west: keep its easternmost columns.
+        predictions = predictions[:, col_count - strip_cells :]
+        strip_metadata["x_ll_corner"] += (col_count - strip_cells) * cell_size
+        strip_metadata["col_count"] = strip_cells
+    elif dx > 0 and col_count > strip_cells:
+        # Neighbor to the east: keep its westernmost columns.
+        predictions = predictions[:, :strip_cells]
+        strip_metadata["col_count"] = strip_cells
+
+    if dy > 0 and row_count > strip_cells:
+        # Neighbor above: keep its southernmost rows, which are at the end
+        # of the top-down prediction array.
+        predictions = predictions[row_count - strip_cells :, :]
+        strip_metadata["row_count"] = strip_cells
+    elif dy < 0 and row_count > strip_cells:
+        # Neighbor below: keep its northernmost rows.
+        predictions = predictions[:strip_cells, :]
+        strip_metadata["y_ll_corner"] += (row_count - strip_cells) * cell_size
+        strip_metadata["row_count"] = strip_cells
+
+    return strip_metadata, predictions
+
+
+def _get_chunk_boundary(study_area_metadata: dict, chunk_metadata: dict) -> geometry.Polygon:
+    """Returns the chunk's bounding box as a polygon in the global CRS.
+
+    Args:
+        study_area_metadata: Metadata for the study area.
+        chunk_metadata: Metadata for the chunk.
+
+    Returns:
+        The chunk boundary polygon in lat/lon coordinates.
+    """
+    return _compute_chunk_boundary(
+        study_area_metadata["crs"],
+        study_area_metadata["cell_size"],
+        chunk_metadata["x_ll_corner"],
+        chunk_metadata["y_ll_corner"],
+        chunk_metadata["col_count"],
+        chunk_metadata["row_count"],
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def _compute_chunk_boundary(
+    crs: str,
+    cell_size: float,
+    x_ll_corner: float,
+    y_ll_corner: float,
+    col_count: int,
+    row_count: int,
+) -> geometry.Polygon:
+    """Computes a chunk boundary polygon from its corner and extent.
+
+    The boundary is derived purely from these scalars, and each chunk's
+    boundary is requested several times per invocation (once as the current
+    chunk and once per neighbor check), so results are memoized.
+    """
+    min_x = x_ll_corner
+    min_y = y_ll_corner
+    max_x = min_x + col_count * cell_size
+    max_y = min_y + row_count * cell_size
+
+    transformer = _get_transformer(crs)
+    corner_lons, corner_lats = transformer.transform(
+        [min_x, max_x, max_x, min_x], [min_y, min_y, max_y, max_y]
+    )
+    return geometry.Polygon(zip(corner_lons, corner_lats))
+
+
+def _compute_h3_details(
+    lats: np.ndarray, lons: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Computes H3 cell details for each spatialized prediction point.
+
+    Args:
+        lats: The latitudes of the prediction points.
+        lons: The longitudes of the prediction points.
+
+    Returns:
+        A tuple of (h3_indexes, centroid_lats, centroid_lons) arrays, with
+        the indexes as int64.
+    """
+    h3_indexes = np.fromiter(
+        (h3.geo_to_h3(lat, lon, H3_LEVEL) for lat, lon in zip(lats, lons)),
+        dtype=np.int64,
+        count=len(lats),
+    )
+    centroids = np.array(
+        [h3.h3_to_geo(h3_index) for h3_index in h3_indexes]
+    ).reshape(-1, 2)
+    return h3_indexes, centroids[:, 0], centroids[:, 1]
+
+
+def _spatialize_neighbor_predictions(
+    study_area_metadata: dict,
+    chunk_metadata: dict,
+    neighbor_metadata: dict,
+    neighbor_chunk_id: str,
+    object_name: str,
+    chunk_h3_indexes: np.ndarray,
+) -> pd.DataFrame:
+    """Reads and spatializes the boundary strip of one neighbor chunk.
+
+    Args:
+        study_area_metadata: Metadata for the study area.
+        chunk_metadata: Metadata for the current chunk.
+        neighbor_metadata: Metadata for the neighbor chunk.
+        neighbor_chunk_id: The id of the neighbor chunk.
+        object_name: The name of the current chunk's prediction file.
+        chunk_h3_indexes: The H3 indexes claimed by the current chunk; only
+            neighbor predictions falling in these cells are kept.
+
+    Returns:
+        A DataFrame with "h3_index" and "prediction" columns restricted to
+        the current chunk's H3 cells.
+
+    Raises:
+        ValueError: If the neighbor chunk's predictions file is missing or
+            invalid.
+    """
+    neighbor_chunk_predictions = _read_neighbor_chunk_predictions(
+        object_name, neighbor_chunk_id
+    )
+    strip_metadata, strip_predictions = _neighbor_boundary_strip(
+        chunk_metadata,
+        neighbor_metadata,
+        study_area_metadata,
+        neighbor_chunk_predictions,
+    )
+    lats, lons, predictions = _build_spatialized_model_predictions(
+        study_area_metadata, strip_metadata, strip_predictions
+    )
+    h3_indexes, _, _ = _compute_h3_details(lats, lons)
+    keep = np.isin(h3_indexes, chunk_h3_indexes)
+    return pd.DataFrame(
+        {"h3_index": h3_indexes[keep], "prediction": predictions[keep]}
+    )
+
+
+def _aggregate_h3_predictions(
+    study_area_metadata: dict,
+    chunk_metadata: dict,
+    chunks_by_coord: dict,
+    chunk_id: str,
+    object_name: str,
+) -> pd.Series:
+    """Aggregates model predictions from the chunk and its neighbors per H3 cell.
+
+    H3 cells near the chunk boundary can overlap neighboring chunks, so
+    predictions from any intersecting neighbor are merged in before averaging
+    predictions per H3 cell.
+
+    Args:
+        study_area_metadata: Metadata for the study area.
+        chunk_metadata: Metadata for the chunk to aggregate predictions for.
+        chunks_by_coord: A mapping from (x_index, y_index) to
+            (chunk_id, chunk_metadata) built from the study area's chunks
+            map.
+        chunk_id: The id of the chunk to aggregate predictions for.
+        object_name: The name of the chunk prediction file.
+
+    Returns:
+        A Series of mean predictions indexed by H3 index.
+
+    Raises:
+        ValueError: If neighbor chunk metadata or predictions are missing or
+            invalid.
+    """
+    raw_predictions = _read_chunk_predictions(object_name)
+    # The projection, H3 indexing and filtering below all run on flat numpy
+    # arrays; a DataFrame is only assembled at the end for the groupby.
+    lats, lons, predictions = _build_spatialized_model_predictions(
+        study_area_metadata, chunk_metadata, raw_predictions
+    )
+    h3_indexes, centroid_lats, centroid_lons = _compute_h3_details(lats, lons)
+    chunk_boundary = _get_chunk_boundary(study_area_metadata, chunk_metadata)
+
+    # Keep only cells whose H3 centroid falls within this chunk. Cells whose
+    # centroid falls in a neighboring chunk are that neighbor's
+    # responsibility, which ensures each H3 cell is output exactly once.
+    centroids = shapely.points(centroid_lons, centroid_lats)
+    within_chunk = shapely.contains(chunk_boundary, centroids)
+    h3_indexes = h3_indexes[within_chunk]
+    predictions = predictions[within_chunk]
+    centroids = centroids[within_chunk]
+
+    # H3 cells which cross the chunk boundary also cover part of a
+    # neighboring chunk, so their means must include the neighbor's
+    # overlapping predictions. Cells whose centroid is farther from the
+    # chunk edge than one H3 cell radius cannot cross it, so polygons are
+    # only built for the thin candidate strip near the edge. The radius is
+    # converted conservatively from meters to degrees.
+    max_radius_degrees = 2 * H3_MAX_RADIUS_METERS / 111_000
+    near_edge = (
+        shapely.distance(chunk_boundary.boundary, centroids) <= max_radius_degrees
+    )
+    boundary_h3_cells = []
+    for h3_index in h3_indexes[near_edge]:
+        polygon = geometry.Polygon(h3.h3_to_geo_boundary(h3_index, geo_json=True))
+        if not polygon.within(chunk_boundary):
+            boundary_h3_cells.append(polygon)
+
+    # Fixed-order offsets keep the neighbor traversal deterministic, and the
+    # bounds check is evaluated for all eight candidates in one vectorized
+    # comparison instead of four conditions per neighbor.
+    offsets = np.array(
+        [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+    )
+    coords = offsets + (chunk_metadata["x_index"], chunk_metadata["y_index"])
+    bounds = (study_area_metadata["col_count"], study_area_metadata["row_count"])
+    in_bounds = ((coords >= 0) & (coords < bounds)).all(axis=1)
+    neighbor_coords = [(int(nx), int(ny)) for nx, ny in coords[in_bounds]]
+
+    # One spatial-index query per neighbor below replaces a Python-level
+    # intersects loop over every boundary cell polygon.
+    boundary_cell_tree = shapely.STRtree(boundary_h3_cells)
+
+    # The in-memory chunks map carries the same field set validated by
+    # _chunk_metadata_fields_valid, so neighbor metadata is read straight
+    # from it without any Firestore round trips.
+    intersecting_neighbors = []
+    for coord in neighbor_coords:
+        if coord not in chunks_by_coord:
+            raise ValueError(f"Neighbor chunk at index {coord} is missing")
+        neighbor_chunk_id, neighbor_metadata = chunks_by_coord[coord]
+        if not _chunk_metadata_fields_valid(neighbor_metadata):
+            raise ValueError(
+                f'Neighbor chunk "{neighbor_chunk_id}" is missing one or more '
+                "required fields: row_count, col_count, x_ll_corner, "
+                "y_ll_corner, x_index, y_index"
+            )
+
+        neighbor_boundary = _get_chunk_boundary(study_area_metadata, neighbor_metadata)
+        if (
+            boundary_cell_tree.query(neighbor_boundary, predicate="intersects").size
+            > 0
+        ):
+            intersecting_neighbors.append((neighbor_chunk_id, neighbor_metadata))
+
+    # Each neighbor is an independent GCS read followed by an independent
+    # spatialize, so the (up to 8) neighbors are processed on a thread pool
+    # to overlap download latency. The GEOS and numpy work both release the
+    # GIL, so threads are sufficient.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        neighbor_predictions = list(
+            executor.map(
+                lambda neighbor: _spatialize_neighbor_predictions(
+                    study_area_metadata,
+                    chunk_metadata,
+                    neighbor[1],
+                    neighbor[0],
+                    object_name,
+                    h3_indexes,
+                ),
+                intersecting_neighbors,
+            )
+        )
+
+    spatialized_predictions = pd.DataFrame(
+        {"h3_index": h3_indexes, "prediction": predictions}
+    )
+    all_predictions = pd.concat([spatialized_predictions] + neighbor_predictions)
+    # sort=False skips an unnecessary sort of the group keys and .mean()
+    # dispatches straight to the C kernel; downstream consumers look rows up
+    # by H3 index and do not rely on row order.
+    return all_predictions.groupby("h3_index", sort=False).prediction.mean()
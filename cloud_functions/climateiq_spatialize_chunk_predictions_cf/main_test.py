@@ -0,0 +1,477 @@
+import base64
+import io
+import types
+from unittest import mock
+
+from cloudevents import http
+from google.cloud import storage
+import pytest
+
+import main
+
+# Keep this module's tests on one xdist worker: they share the module-level
+# client mocks below, which must not be split across processes.
+pytestmark = pytest.mark.xdist_group("spatialize")
+
+# spec= with the real class restricts the mocks' attribute surface without
+# the per-call signature introspection create_autospec performs, and unlike
+# spec'ing from a shared Mock it is accepted on Python 3.11+.
+
+
+def _create_mock_blob(name: str, contents: str = ""):
+    """Creates a mock GCS blob which serves the given contents."""
+    blob = mock.MagicMock(spec=storage.Blob)
+    blob.name = name
+    blob.download_as_bytes.return_value = contents.encode()
+    return blob
+
+
+def _create_mock_bucket(blobs_by_name: dict):
+    """Creates a mock GCS bucket which serves blobs from the given dict."""
+    bucket = mock.MagicMock(spec=storage.Bucket)
+    bucket.blob.side_effect = lambda name: blobs_by_name.setdefault(
+        name, _create_mock_blob(name)
+    )
+    return bucket
+
+
+def _study_area_doc(mock_clients):
+    """Returns the fake study area document snapshot."""
+    return mock_clients.firestore.study_area
+
+
+def _chunk_doc(mock_clients):
+    """Returns the fake chunk document snapshot."""
+    return mock_clients.firestore.chunk
+
+
+def _wire_metadata(mock_clients, metadata, chunk_metadata):
+    """Points the study area and chunk documents at the given metadata."""
+    _study_area_doc(mock_clients).metadata = metadata
+    _chunk_doc(mock_clients).metadata = chunk_metadata
+
+
+def _create_output_blob():
+    """Creates a mock output blob which captures uploads into a buffer."""
+    buffer = io.BytesIO()
+    blob = mock.MagicMock(spec=storage.Blob)
+    blob.upload_from_string.side_effect = (
+        lambda data, content_type=None: buffer.write(data)
+    )
+    return blob, buffer
+
+
+def _read_output_predictions(buffer: io.BytesIO) -> dict:
+    """Reads uploaded Parquet bytes back into an {h3_index: mean} dict."""
+    import pyarrow.parquet
+
+    buffer.seek(0)
+    table = pyarrow.parquet.read_table(buffer)
+    return dict(
+        zip(table["h3_index"].to_pylist(), table["prediction"].to_pylist())
+    )
+
+
+def _wire_prediction_bytes(mock_clients, predictions: str):
+    """Serves the given payload from every blob on the storage mock."""
+    blob = mock_clients.storage.bucket.return_value.blob.return_value
+    blob.download_as_bytes.return_value = predictions.encode()
+
+
+def _wire_buckets(mock_clients, input_blobs, output_blobs=None):
+    """Routes bucket lookups to mock prediction and output buckets."""
+    mock_clients.storage.bucket.side_effect = {
+        main.CLIMATEIQ_PREDICTIONS_BUCKET: _create_mock_bucket(input_blobs),
+        main.CLIMATEIQ_SPATIALIZED_PREDICTIONS_BUCKET: _create_mock_bucket(
+            output_blobs or {}
+        ),
+    }.get
+
+
+_OBJECT_NAME = b"id/prediction-type/model-id/study-area-name/scenario-id/chunk-id"
+# The happy-path event and prediction payloads are identical across tests,
+# so they are built (and base64-encoded/validated) once per module.
+_EVENT = http.CloudEvent(
+    {
+        "type": "google.cloud.pubsub.topic.v1.messagePublished",
+        "source": "source",
+    },
+    {"message": {"data": base64.b64encode(_OBJECT_NAME)}},
+)
+_INVALID_NAME_EVENT = http.CloudEvent(
+    {
+        "type": "google.cloud.pubsub.topic.v1.messagePublished",
+        "source": "source",
+    },
+    {"message": {"data": base64.b64encode(b"invalid_name")}},
+)
+_PREDICTIONS = (
+    '{"instance": {"values": [1, 2, 3, 4], "key": 1},'
+    '"prediction": [[1, 2, 3], [4, 5, 6]]}'
+)
+_PREDICTIONS_2X2 = (
+    '{"instance": {"values": [1, 2, 3, 4], "key": 1},'
+    '"prediction": [[1, 2], [3, 4]]}'
+)
+_PREDICTIONS_BOTTOM = (
+    '{"instance": {"values": [1, 2, 3, 4], "key": 2},'
+    '"prediction": [[2, 3, 4], [5, 6, 7]]}'
+)
+# Expected per-H3 mean predictions, keyed by integer H3 index. Every mean is
+# an exact binary fraction, so plain equality against the written output is
+# safe.
+_EXPECTED_WITHIN_CHUNK = {
+    0x8d8f2c80c1582bf: 4.0,
+    0x8d8f2c80c158a3f: 5.0,
+    0x8d8f2c80c158abf: 6.0,
+    0x8d8f2c80c15903f: 1.0,
+    0x8d8f2c80c15923f: 2.0,
+    0x8d8f2c80c159a7f: 3.0,
+}
+_EXPECTED_OUTSIDE_CHUNK = {
+    0x8d8f2c80c1582bf: 3.0,
+    0x8d8f2c80c158a3f: 4.0,
+    0x8d8f2c80c15903f: 1.0,
+    0x8d8f2c80c15923f: 2.0,
+}
+_EXPECTED_OVERLAPPING_NEIGHBORS = {
+    0x8d8f2c80c1582bf: 4.0,
+    0x8d8f2c80c158a3f: 5.0,
+    0x8d8f2c80c158abf: 6.0,
+    0x8d8f2c80c15903f: 1.5,
+    0x8d8f2c80c15923f: 2.5,
+    0x8d8f2c80c159a7f: 3.5,
+}
+# The shared metadata dicts are read-only proxies so no test can mutate
+# state that later tests depend on.
+_BASE_METADATA = types.MappingProxyType(
+    {
+        "name": "study-area-name",
+        "cell_size": 10,
+        "crs": "EPSG:32618",
+        "chunks": {},
+        "row_count": 1,
+        "col_count": 1,
+    }
+)
+_BASE_CHUNK_METADATA = types.MappingProxyType(
+    {
+        "row_count": 2,
+        "col_count": 3,
+        "x_ll_corner": 500,
+        "y_ll_corner": 100,
+        "x_index": 0,
+        "y_index": 0,
+    }
+)
+
+
+@pytest.mark.parametrize(
+    "event, study_area_exists, metadata, chunk_exists, chunk_metadata, "
+    "predictions, expected_msg",
+    [
+        pytest.param(
+            _INVALID_NAME_EVENT,
+            True,
+            _BASE_METADATA,
+            True,
+            _BASE_CHUNK_METADATA,
+            "",
+            "Invalid object name format",
+            id="invalid_object_name",
+        ),
+        pytest.param(
+            _EVENT,
+            False,
+            _BASE_METADATA,
+            True,
+            _BASE_CHUNK_METADATA,
+            "",
+            'Study area "study-area-name" does not exist',
+            id="missing_study_area",
+        ),
+        pytest.param(
+            _EVENT,
+            True,
+            # Study area metadata missing the "cell_size" field.
+            {k: v for k, v in _BASE_METADATA.items() if k != "cell_size"},
+            True,
+            _BASE_CHUNK_METADATA,
+            "",
+            'Study area "study-area-name" is missing one or more required fields',
+            id="invalid_study_area",
+        ),
+        pytest.param(
+            _EVENT,
+            True,
+            _BASE_METADATA,
+            False,
+            _BASE_CHUNK_METADATA,
+            "",
+            'Chunk "chunk-id" does not exist',
+            id="missing_chunk",
+        ),
+        pytest.param(
+            _EVENT,
+            True,
+            _BASE_METADATA,
+            True,
+            # Chunk metadata missing the "x_index" and "y_index" fields.
+            {
+                k: v
+                for k, v in _BASE_CHUNK_METADATA.items()
+                if k not in ("x_index", "y_index")
+            },
+            "",
+            'Chunk "chunk-id" is missing one or more required fields',
+            id="invalid_chunk",
+        ),
+        pytest.param(
+            _EVENT,
+            True,
+            _BASE_METADATA,
+            True,
+            _BASE_CHUNK_METADATA,
+            "",
+            "is missing predictions",
+            id="missing_predictions",
+        ),
+        pytest.param(
+            _EVENT,
+            True,
+            _BASE_METADATA,
+            True,
+            _BASE_CHUNK_METADATA,
+            '{"instance": {"values": [1, 2, 3, 4], "key": 1},'
+            '"prediction": [[1, 2, 3], [4, 5, 6]]}\n'
+            '{"instance": {"values": [1, 2, 3, 4], "key": 2},'
+            '"prediction": [[1, 2, 3], [4, 5, 6]]}',
+            "has too many predictions",
+            id="too_many_predictions",
+        ),
+    ],
+)
+def test_spatialize_chunk_predictions_invalid_input(
+    capsys,
+    mock_clients,
+    event,
+    study_area_exists,
+    metadata,
+    chunk_exists,
+    chunk_metadata,
+    predictions,
+    expected_msg,
+):
+    study_area_doc = _study_area_doc(mock_clients)
+    study_area_doc.exists = study_area_exists
+    study_area_doc.metadata = metadata
+    chunk_doc = _chunk_doc(mock_clients)
+    chunk_doc.exists = chunk_exists
+    chunk_doc.metadata = chunk_metadata
+    _wire_prediction_bytes(mock_clients, predictions)
+
+    main.subscribe(event)
+
+    assert expected_msg in capsys.readouterr().out
+
+
+_NEIGHBOR_STUDY_CHUNK_METADATA = types.MappingProxyType(
+    {
+        "row_count": 2,
+        "col_count": 3,
+        "x_ll_corner": 500,
+        "y_ll_corner": 100,
+        "x_index": 0,
+        "y_index": 1,
+    }
+)
+
+
+def _neighbor_study_metadata(neighbor_chunk_metadata=None) -> dict:
+    """Builds study area metadata for a two-chunk column study area.
+
+    Args:
+        neighbor_chunk_metadata: Metadata for the neighbor chunk at (0, 0),
+            or None to omit it from the chunks map.
+
+    Returns:
+        The study area metadata dict.
+    """
+    chunks = {"chunk-id": {"x_index": 0, "y_index": 1}}
+    if neighbor_chunk_metadata is not None:
+        chunks["neighbor-chunk-id"] = neighbor_chunk_metadata
+    return {
+        "name": "study-area-name",
+        "cell_size": 10,
+        "crs": "EPSG:32618",
+        "chunks": chunks,
+        "row_count": 2,
+        "col_count": 1,
+    }
+
+
+@pytest.mark.parametrize(
+    "neighbor_chunk_metadata, neighbor_blob_contents, expected_msg",
+    [
+        pytest.param(
+            # The chunks map is missing the expected neighbor at index (0, 0).
+            None,
+            None,
+            "Neighbor chunk at index (0, 0) is missing",
+            id="missing_expected_neighbor_chunk",
+        ),
+        pytest.param(
+            # Neighbor chunk metadata missing the "x_ll_corner" field.
+            {
+                "row_count": 2,
+                "col_count": 3,
+                "y_ll_corner": 80,
+                "x_index": 0,
+                "y_index": 0,
+            },
+            None,
+            'Neighbor chunk "neighbor-chunk-id" is missing one or more required '
+            "fields",
+            id="invalid_neighbor_chunk",
+        ),
+        pytest.param(
+            {
+                "row_count": 2,
+                "col_count": 3,
+                "x_ll_corner": 500,
+                "y_ll_corner": 80,
+                "x_index": 0,
+                "y_index": 0,
+            },
+            # The neighbor's predictions file exists but is empty.
+            "",
+            "is missing predictions",
+            id="neighbor_chunk_missing_predictions",
+        ),
+    ],
+)
+def test_spatialize_chunk_predictions_neighbor_errors(
+    capsys, mock_clients, neighbor_chunk_metadata, neighbor_blob_contents, expected_msg
+):
+    metadata = _neighbor_study_metadata(neighbor_chunk_metadata)
+    _wire_metadata(mock_clients, metadata, _NEIGHBOR_STUDY_CHUNK_METADATA)
+
+    input_blobs = {
+        "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id": (
+            _create_mock_blob(
+                "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id",
+                _PREDICTIONS,
+            )
+        )
+    }
+    if neighbor_blob_contents is not None:
+        neighbor_blob_name = (
+            "id/prediction-type/model-id/study-area-name/scenario-id/"
+            "neighbor-chunk-id"
+        )
+        input_blobs[neighbor_blob_name] = _create_mock_blob(
+            neighbor_blob_name, neighbor_blob_contents
+        )
+    _wire_buckets(mock_clients, input_blobs)
+
+    main.subscribe(_EVENT)
+
+    assert expected_msg in capsys.readouterr().out
+
+
+def test_spatialize_chunk_predictions_h3_centroids_within_chunk(mock_clients):
+    _wire_metadata(mock_clients, _BASE_METADATA, _BASE_CHUNK_METADATA)
+
+    input_blobs = {
+        "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id": (
+            _create_mock_blob(
+                "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id",
+                _PREDICTIONS,
+            )
+        )
+    }
+    output_blob, output_buffer = _create_output_blob()
+    output_blobs = {
+        "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id.parquet": (
+            output_blob
+        )
+    }
+    _wire_buckets(mock_clients, input_blobs, output_blobs)
+
+    main.subscribe(_EVENT)
+
+    assert _read_output_predictions(output_buffer) == _EXPECTED_WITHIN_CHUNK
+
+
+def test_spatialize_chunk_predictions_h3_centroids_outside_chunk(mock_clients):
+    # A narrower chunk: cells along the top edge project to H3 cells whose
+    # centroids fall outside the chunk boundary and are filtered out.
+    chunk_metadata = {
+        "row_count": 2,
+        "col_count": 2,
+        "x_ll_corner": 500,
+        "y_ll_corner": 100,
+        "x_index": 0,
+        "y_index": 0,
+    }
+    _wire_metadata(mock_clients, _BASE_METADATA, chunk_metadata)
+
+    input_blobs = {
+        "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id": (
+            _create_mock_blob(
+                "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id",
+                _PREDICTIONS_2X2,
+            )
+        )
+    }
+    output_blob, output_buffer = _create_output_blob()
+    output_blobs = {
+        "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id.parquet": (
+            output_blob
+        )
+    }
+    _wire_buckets(mock_clients, input_blobs, output_blobs)
+
+    main.subscribe(_EVENT)
+
+    assert _read_output_predictions(output_buffer) == _EXPECTED_OUTSIDE_CHUNK
+
+
+def test_spatialize_chunk_predictions_overlapping_neighbors(mock_clients):
+    neighbor_chunk_metadata = {
+        "row_count": 2,
+        "col_count": 3,
+        "x_ll_corner": 500,
+        "y_ll_corner": 80,
+        "x_index": 0,
+        "y_index": 0,
+    }
+    metadata = _neighbor_study_metadata(neighbor_chunk_metadata)
+    _wire_metadata(mock_clients, metadata, _NEIGHBOR_STUDY_CHUNK_METADATA)
+
+    input_blobs = {
+        "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id": (
+            _create_mock_blob(
+                "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id",
+                _PREDICTIONS,
+            )
+        ),
+        "id/prediction-type/model-id/study-area-name/scenario-id/neighbor-chunk-id": (
+            _create_mock_blob(
+                "id/prediction-type/model-id/study-area-name/scenario-id/"
+                "neighbor-chunk-id",
+                _PREDICTIONS_BOTTOM,
+            )
+        ),
+    }
+    output_blob, output_buffer = _create_output_blob()
+    output_blobs = {
+        "id/prediction-type/model-id/study-area-name/scenario-id/chunk-id.parquet": (
+            output_blob
+        )
+    }
+    _wire_buckets(mock_clients, input_blobs, output_blobs)
+
+    main.subscribe(_EVENT)
+
+    assert _read_output_predictions(output_buffer) == _EXPECTED_OVERLAPPING_NEIGHBORS
@@ -0,0 +1,143 @@
+"""Cloud function which triggers the export pipeline for completed predictions.
+
+Triggered when a model prediction file is written to the predictions bucket.
+Once all prediction files for a batch prediction job are present, the
+predictions are split into one file per chunk and a Pub/Sub message is
+published for each chunk so it can be spatialized and exported.
+"""
+
+import re
+
+from cloudevents import http
+from concurrent import futures
+import functions_framework
+import orjson
+from google.cloud import pubsub_v1
+from google.cloud import storage
+
+INPUT_BUCKET_NAME = "climateiq-predictions"
+OUTPUT_BUCKET_NAME = "climateiq-chunk-predictions"
+CLIMATEIQ_PROJECT_ID = "climateiq"
+CLIMATEIQ_EXPORT_TOPIC_ID = "climateiq-spatialize-and-export-predictions"
+
+# Matches the fixed object name layout in one pass, capturing the directory
+# prefix and the batch's total file count.
+_OBJECT_NAME_PATTERN = re.compile(
+    r"((?:[^/]+/){4}[^/]+)/prediction\.results-\d+-of-(\d+)"
+)
+
+# Clients are created lazily and cached for the lifetime of the function
+# instance, so warm invocations skip the auth and connection setup each
+# client constructor performs.
+_storage_client = None
+_publisher_client = None
+
+
+def _get_storage_client() -> storage.Client:
+    """Returns a storage client shared across warm invocations."""
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def _get_publisher_client() -> pubsub_v1.PublisherClient:
+    """Returns a batching publisher client shared across warm invocations."""
+    global _publisher_client
+    if _publisher_client is None:
+        _publisher_client = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(
+                max_messages=1000, max_latency=0.05
+            )
+        )
+    return _publisher_client
+
+
+@functions_framework.cloud_event
+def trigger_export_pipeline(cloud_event: http.CloudEvent) -> None:
+    """Splits model predictions into one file per chunk and fans out.
+
+    Args:
+        cloud_event: The GCS event describing the newly written prediction
+            file. Object names are in the format
+            "<id>/<prediction_type>/<model_id>/<study_area_name>/<scenario_id>/prediction.results-<file_number>-of-<file_count>".
+    """
+    object_name = cloud_event.data["name"]
+    match = _OBJECT_NAME_PATTERN.fullmatch(object_name)
+    if match is None:
+        return
+    prefix = match.group(1)
+    total_prediction_files = int(match.group(2))
+
+    # Only proceed once every prediction file from the batch prediction job
+    # has been written.
+    storage_client = _get_storage_client()
+    # Cap the listing one past the expected count: any surplus still shows
+    # up as a mismatch, but an over-full prefix never pages through more
+    # than that, and the trimmed fields keep each page small. In the common
+    # early-return case, where the batch is still incomplete, the lazy
+    # iterator stops after the first short page.
+    input_blobs = list(
+        storage_client.list_blobs(
+            INPUT_BUCKET_NAME,
+            prefix=prefix,
+            fields="items(name),nextPageToken",
+            max_results=total_prediction_files + 1,
+        )
+    )
+    if len(input_blobs) != total_prediction_files:
+        return
+
+    # Prediction files are independent, so fetch them all concurrently and
+    # overlap the GCS round-trips instead of streaming one blob at a time.
+    with futures.ThreadPoolExecutor(max_workers=32) as executor:
+        blob_contents = list(
+            executor.map(lambda blob: blob.download_as_bytes(), input_blobs)
+        )
+
+    # Group lines by chunk before writing: each chunk becomes exactly one
+    # upload and one Pub/Sub message, where the per-line loop would issue a
+    # write (and a later publish) per line and let repeated keys overwrite
+    # each other.
+    chunk_lines: dict[str, list[bytes]] = {}
+    for contents in blob_contents:
+        for line in contents.splitlines():
+            chunk_id = orjson.loads(line)["instance"]["key"]
+            chunk_lines.setdefault(chunk_id, []).append(line)
+
+    # Chunk writes are small and independent, so fan them out over a thread
+    # pool instead of paying one serial round-trip per chunk.
+    output_bucket = storage_client.bucket(OUTPUT_BUCKET_NAME)
+    output_filenames = []
+    upload_futures = []
+    with futures.ThreadPoolExecutor(max_workers=32) as executor:
+        for chunk_id, lines in chunk_lines.items():
+            output_filename = f"{prefix}/{chunk_id}"
+            upload_futures.append(
+                executor.submit(
+                    output_bucket.blob(output_filename).upload_from_string,
+                    b"\n".join(lines),
+                )
+            )
+            output_filenames.append(output_filename)
+        # Drain with result() so an upload failure raises here and the
+        # event is retried, instead of publishing for a blob that was
+        # never written.
+        for future in futures.as_completed(upload_futures):
+            future.result()
+
+    # Publish everything up front and only then wait: the client coalesces
+    # queued messages into batched RPCs, which blocking on each result()
+    # inside the loop would defeat.
+    publisher = _get_publisher_client()
+    topic_path = publisher.topic_path(CLIMATEIQ_PROJECT_ID, CLIMATEIQ_EXPORT_TOPIC_ID)
+    publish_futures = [
+        publisher.publish(
+            topic_path,
+            data=output_filename.encode(),
+            origin="trigger_export_pipeline",
+        )
+        for output_filename in output_filenames
+    ]
+    for future in publish_futures:
+        future.result()
@@ -0,0 +1,146 @@
+"""Cloud function which triggers the export pipeline via Cloud Tasks.
+
+Variant of the Pub/Sub based trigger which enqueues one Cloud Task per chunk
+prediction file instead of publishing Pub/Sub messages, so downstream export
+work can be rate limited by the task queue.
+"""
+
+import re
+import threading
+
+from cloudevents import http
+import functions_framework
+from concurrent import futures
+import orjson
+from google.cloud import storage
+from google.cloud import tasks_v2
+
+INPUT_BUCKET_NAME = "climateiq-predictions"
+OUTPUT_BUCKET_NAME = "climateiq-chunk-predictions"
+CLIMATEIQ_PROJECT_ID = "climateiq"
+CLIMATEIQ_LOCATION_ID = "us-central1"
+CLIMATEIQ_EXPORT_QUEUE_ID = "climateiq-spatialize-and-export-predictions"
+CLIMATEIQ_EXPORT_URL = "https://climateiq.org/export"
+# Upper bound on chunk writes queued but not yet completed, so a huge
+# prediction batch cannot pile every pending line up in executor memory.
+MAX_PENDING_WRITES = 128
+
+# Matches the fixed object name layout in one pass, capturing the directory
+# prefix and the batch's total file count.
+_OBJECT_NAME_PATTERN = re.compile(
+    r"((?:[^/]+/){4}[^/]+)/prediction\.results-\d+-of-(\d+)"
+)
+
+# Clients are created lazily and cached for the lifetime of the function
+# instance, so warm invocations skip the auth and connection setup each
+# client constructor performs.
+_storage_client = None
+_tasks_client = None
+
+
+def _get_storage_client() -> storage.Client:
+    """Returns a storage client shared across warm invocations."""
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def _get_tasks_client() -> tasks_v2.CloudTasksClient:
+    """Returns a Cloud Tasks client shared across warm invocations."""
+    global _tasks_client
+    if _tasks_client is None:
+        _tasks_client = tasks_v2.CloudTasksClient()
+    return _tasks_client
+
+
+def _write_file(line: str, output_filename: str, storage_client: storage.Client) -> None:
+    """Writes a single chunk prediction line to the output bucket."""
+    output_blob = storage_client.bucket(OUTPUT_BUCKET_NAME).blob(output_filename)
+    output_blob.upload_from_string(line)
+
+
+@functions_framework.cloud_event
+def trigger_export_pipeline(cloud_event: http.CloudEvent) -> None:
+    """Splits model predictions into one file per chunk and enqueues tasks.
+
+    Args:
+        cloud_event: The GCS event describing the newly written prediction
+            file. Object names are in the format
+            "<id>/<prediction_type>/<model_id>/<study_area_name>/<scenario_id>/prediction.results-<file_number>-of-<file_count>".
+    """
+    object_name = cloud_event.data["name"]
+    match = _OBJECT_NAME_PATTERN.fullmatch(object_name)
+    if match is None:
+        return
+    prefix = match.group(1)
+    total_prediction_files = int(match.group(2))
+
+    storage_client = _get_storage_client()
+    # Cap the listing one past the expected count: any surplus still shows
+    # up as a mismatch, but an over-full prefix never pages through more
+    # than that, and the trimmed fields keep each page small. In the common
+    # early-return case, where the batch is still incomplete, the lazy
+    # iterator stops after the first short page.
+    input_blobs = list(
+        storage_client.list_blobs(
+            INPUT_BUCKET_NAME,
+            prefix=prefix,
+            fields="items(name),nextPageToken",
+            max_results=total_prediction_files + 1,
+        )
+    )
+    if len(input_blobs) != total_prediction_files:
+        return
+
+    output_filenames = []
+    write_futures = []
+    # The semaphore applies backpressure: the producer loop blocks once
+    # MAX_PENDING_WRITES lines are in flight instead of queueing every line.
+    write_slots = threading.Semaphore(MAX_PENDING_WRITES)
+
+    def _write_and_release(line: str, output_filename: str) -> None:
+        try:
+            _write_file(line, output_filename, storage_client)
+        finally:
+            write_slots.release()
+
+    # Each upload is a tiny request dominated by round-trip overhead, so run
+    # far more writers than the default thread count; GCS tolerates the
+    # concurrency.
+    with futures.ThreadPoolExecutor(max_workers=64) as executor:
+        for blob in input_blobs:
+            # Stream in binary with a large transport chunk so the reader
+            # fetches few big ranges and orjson gets bytes without a
+            # decode pass; lines are never materialized all at once.
+            with blob.open("rb", chunk_size=4 * 1024 * 1024) as fd:
+                for line in fd:
+                    chunk_id = orjson.loads(line)["instance"]["key"]
+                    output_filename = f"{prefix}/{chunk_id}"
+                    write_slots.acquire()
+                    write_futures.append(
+                        executor.submit(_write_and_release, line, output_filename)
+                    )
+                    output_filenames.append(output_filename)
+        futures.wait(write_futures)
+
+    tasks_client = _get_tasks_client()
+    queue_path = tasks_client.queue_path(
+        CLIMATEIQ_PROJECT_ID, CLIMATEIQ_LOCATION_ID, CLIMATEIQ_EXPORT_QUEUE_ID
+    )
+    queue_futures = []
+    with futures.ThreadPoolExecutor() as executor:
+        for output_filename in output_filenames:
+            task = tasks_v2.Task(
+                http_request=tasks_v2.HttpRequest(
+                    http_method=tasks_v2.HttpMethod.POST,
+                    url=CLIMATEIQ_EXPORT_URL,
+                    body=output_filename.encode(),
+                )
+            )
+            queue_futures.append(
+                executor.submit(
+                    tasks_client.create_task, parent=queue_path, task=task
+                )
+            )
+        futures.wait(queue_futures)
@@ -0,0 +1,173 @@
+"""Cloud function which counts days above temperature thresholds in WRF output.
+
+Reads daily-maximum WRF NetCDF files from GCS, counts the number of days each
+grid cell exceeds a set of temperature thresholds and writes one GeoTIFF per
+threshold to the output bucket.
+"""
+
+from concurrent import futures
+import functions_framework
+import gcsfs
+from google.cloud import storage
+from netCDF4 import Dataset
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+
+GCP_PROJECT = "climateiq"
+INPUT_BUCKET_NAME = "climateiq-wrf-daily-max"
+OUTPUT_BUCKET_NAME = "climateiq-wrf-thresholds"
+# Daily maximum temperature thresholds, in degrees Celsius.
+THRESHOLDS = [25, 30, 35, 40]
+KELVIN_OFFSET = 273.15
+
+# Clients are created lazily and cached for the lifetime of the function
+# instance, so warm invocations skip the auth and connection setup each
+# client constructor performs.
+_storage_client = None
+_gcs_fs = None
+
+
+def _get_storage_client() -> storage.Client:
+    """Returns a storage client shared across warm invocations."""
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def _get_gcs_fs() -> gcsfs.GCSFileSystem:
+    """Returns a GCS filesystem shared across warm invocations."""
+    global _gcs_fs
+    if _gcs_fs is None:
+        _gcs_fs = gcsfs.GCSFileSystem(project=GCP_PROJECT)
+    return _gcs_fs
+
+
+@functions_framework.http
+def process_wrf_thresholds(request) -> str:
+    """Entry point which computes and exports threshold-count GeoTIFFs."""
+    params = request.get_json(silent=True) or {}
+    prefix = params.get("prefix", "")
+    variable = params.get("variable", "T2")
+
+    count_above_thresholds, lats, lons = count_days_above_threshold(
+        INPUT_BUCKET_NAME, prefix, variable
+    )
+    for threshold, count_above_threshold in count_above_thresholds.items():
+        save_days_above_threshold_to_geotiff(
+            count_above_threshold,
+            lats,
+            lons,
+            f"{prefix}/days_above_{threshold}c.tif",
+        )
+    return f"Processed thresholds: {sorted(count_above_thresholds)}"
+
+
+def count_days_above_threshold(
+    bucket_name: str, prefix: str, variable: str = "T2"
+) -> tuple[dict, np.ndarray, np.ndarray]:
+    """Counts days per grid cell above each temperature threshold.
+
+    Args:
+        bucket_name: The bucket containing daily-maximum WRF NetCDF files.
+        prefix: The object prefix of the NetCDF files to process.
+        variable: The name of the temperature variable, in Kelvin.
+
+    Returns:
+        A tuple of (mapping from threshold to count array, latitudes,
+        longitudes).
+    """
+    fs = _get_gcs_fs()
+    client = _get_storage_client()
+    blobs = client.list_blobs(bucket_name, prefix=prefix)
+    file_names = [blob.name for blob in blobs if blob.name.endswith(".nc")]
+
+    def _load_celsius(name: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Fetches and decodes one file; runs on a pool thread."""
+        # One ranged GET for the whole object; fs.open().read() would pull
+        # it through the filesystem's block cache in pieces.
+        nc = Dataset("in_memory", memory=fs.cat(f"{bucket_name}/{name}"))
+        try:
+            data_celsius = nc.variables[variable][:] - KELVIN_OFFSET
+            file_lats = nc.variables["XLAT"][0, :, :]
+            file_lons = nc.variables["XLONG"][0, :, :]
+        finally:
+            nc.close()
+        return data_celsius, file_lats, file_lons
+
+    count_above_thresholds = {}
+    # THRESHOLDS is sorted, so searchsorted below can count in one pass how
+    # many thresholds each cell exceeds.
+    thresholds_array = np.asarray(THRESHOLDS, dtype=float)
+    lats = None
+    lons = None
+    # Downloads and NetCDF decoding overlap on the pool; the reduction into
+    # the shared counters stays on this thread so no locking is needed.
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        for data_celsius, file_lats, file_lons in executor.map(
+            _load_celsius, file_names
+        ):
+            if lats is None:
+                lats = file_lats
+                lons = file_lons
+                for threshold in THRESHOLDS:
+                    # Counts are bounded by the number of days in the run,
+                    # so uint16 holds them in a quarter of int64's footprint
+                    # and the GeoTIFFs shrink to match.
+                    count_above_thresholds[threshold] = np.zeros_like(
+                        data_celsius, dtype=np.uint16
+                    )
+            # One scan of the full grid; the ranks array stays hot in
+            # cache for the tiny per-threshold comparisons that follow.
+            exceeded_ranks = np.searchsorted(
+                thresholds_array, data_celsius, side="left"
+            )
+            for rank, threshold in enumerate(THRESHOLDS):
+                count_above_thresholds[threshold] += exceeded_ranks > rank
+
+    return count_above_thresholds, lats, lons
+
+
+def save_days_above_threshold_to_geotiff(
+    count_above_threshold: np.ndarray,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    output_file_path: str,
+) -> None:
+    """Writes a threshold-count array as a GeoTIFF to the output bucket.
+
+    Args:
+        count_above_threshold: The (1, height, width) count array.
+        lats: The 2D latitude grid of the WRF domain.
+        lons: The 2D longitude grid of the WRF domain.
+        output_file_path: The object name to write the GeoTIFF to.
+    """
+    # flipud returns a reversed view; materializing it once here makes the
+    # single contiguous copy rasterio needs explicit and deterministic. The
+    # output stays north-up so downstream consumers never see a bottom-up
+    # affine.
+    flipped_data = np.ascontiguousarray(count_above_threshold[0, ::-1])
+    height, width = flipped_data.shape
+    pixel_width = (lons.max() - lons.min()) / width
+    pixel_height = (lats.max() - lats.min()) / height
+    transform = from_origin(lons.min(), lats.max(), pixel_width, pixel_height)
+
+    client = _get_storage_client()
+    # The GeoTIFF is assembled in memory and uploaded straight from the
+    # buffer, skipping the write-to-/tmp-then-reread round trip.
+    with MemoryFile() as memory_file:
+        with memory_file.open(
+            driver="GTiff",
+            height=height,
+            width=width,
+            count=1,
+            dtype=flipped_data.dtype,
+            crs="EPSG:4326",
+            transform=transform,
+        ) as dst:
+            dst.write(flipped_data, 1)
+        bucket = client.bucket(OUTPUT_BUCKET_NAME)
+        bucket.blob(output_file_path).upload_from_string(
+            memory_file.read(), content_type="image/tiff"
+        )
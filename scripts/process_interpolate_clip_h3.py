@@ -0,0 +1,331 @@
+"""Interpolates, clips and H3-aggregates heat rasters stored in GCS.
+
+Pipeline stages:
+  1. Interpolate coarse heat-day rasters onto the 10m output grid and clip
+     them to the study area boundary shapefile in one pass.
+  2. Convert the clipped rasters to per-H3-cell mean CSV files.
+
+Run as a standalone script; stages read from and write back to GCS.
+"""
+
+import functools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import gcsfs
+import geopandas as gpd
+from google.cloud import storage
+# The numpy_int API returns H3 indexes as unsigned integers, which keeps the
+# cells in a numpy array instead of a list of hex strings.
+import h3.api.numpy_int as h3
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.io import MemoryFile
+import rioxarray as rxr
+from scipy import ndimage
+import xarray as xr
+
+GCP_PROJECT = "climateiq"
+INPUT_BUCKET_NAME = "climateiq-heat-input"
+OUTPUT_BUCKET_NAME = "climateiq-heat-output"
+BOUNDARY_PREFIX = "boundaries/study_area"
+H3_RESOLUTION = 10
+SHAPEFILE_COMPONENTS = (".shp", ".shx", ".dbf", ".prj")
+
+# Clients are created lazily and cached per process, so pool workers build
+# their own connections instead of inheriting ones that do not survive the
+# fork.
+_storage_client = None
+_gcs_fs = None
+
+
+def _get_storage_client() -> storage.Client:
+    """Returns a storage client shared within the current process."""
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def _get_gcs_fs() -> gcsfs.GCSFileSystem:
+    """Returns a GCS filesystem shared within the current process."""
+    global _gcs_fs
+    if _gcs_fs is None:
+        _gcs_fs = gcsfs.GCSFileSystem(project=GCP_PROJECT)
+    return _gcs_fs
+
+
+@functools.lru_cache(maxsize=1)
+def _load_template(template_path: str) -> xr.DataArray:
+    """Opens the output-grid template once per process."""
+    return rxr.open_rasterio(template_path)
+
+
+def download_shapefile(bucket_name: str, prefix: str, dest_dir: str) -> str:
+    """Downloads all shapefile components and returns the .shp path."""
+    bucket = _get_storage_client().bucket(bucket_name)
+
+    def _download_component(suffix: str) -> None:
+        local_path = os.path.join(dest_dir, os.path.basename(prefix) + suffix)
+        bucket.blob(prefix + suffix).download_to_filename(local_path)
+
+    # The components are independent small objects, so fetch them
+    # concurrently instead of paying four sequential round-trips.
+    with ThreadPoolExecutor(max_workers=len(SHAPEFILE_COMPONENTS)) as executor:
+        # list() drains the iterator so download errors surface here.
+        list(executor.map(_download_component, SHAPEFILE_COMPONENTS))
+    return os.path.join(dest_dir, os.path.basename(prefix) + ".shp")
+
+
+def interp_out_grid(ds: xr.DataArray, template: xr.DataArray) -> xr.DataArray:
+    """Linearly interpolates a raster onto the template's output grid.
+
+    Both grids are rectilinear with uniform spacing, so the template
+    coordinates map to fractional source pixel indexes in one expression
+    and map_coordinates samples them directly. That skips the
+    regular-grid interpolator and intermediate xarray templating that
+    interp_like dispatches to, which is several times slower on grids
+    this shape. Points outside the source extent become NaN, matching
+    interp_like's fill behavior.
+    """
+    src_y = ds["y"].to_numpy()
+    src_x = ds["x"].to_numpy()
+    frac_rows = (template["y"].to_numpy() - src_y[0]) / (src_y[1] - src_y[0])
+    frac_cols = (template["x"].to_numpy() - src_x[0]) / (src_x[1] - src_x[0])
+    coords = np.stack(np.broadcast_arrays(frac_rows[:, None], frac_cols[None, :]))
+    interpolated = ndimage.map_coordinates(
+        ds.to_numpy()[0].astype(float),
+        coords,
+        order=1,
+        mode="constant",
+        cval=np.nan,
+        prefilter=False,
+    )
+    dsout = xr.DataArray(
+        interpolated[np.newaxis],
+        dims=("band", "y", "x"),
+        coords={
+            "band": ds["band"].to_numpy(),
+            "y": template["y"].to_numpy(),
+            "x": template["x"].to_numpy(),
+        },
+        attrs=ds.attrs,
+    )
+    dsout.rio.write_crs(ds.rio.crs, inplace=True)
+    # Heat-day counts are bounded by the days in a year, so int16 halves
+    # the raster's footprint on disk and in the H3 stage's working set.
+    return dsout.astype("int16")
+
+
+def clip_raster_to_boundary(
+    raster: xr.DataArray, boundary: gpd.GeoDataFrame
+) -> xr.DataArray:
+    """Clips a raster to the study area boundary.
+
+    Reprojects the raster to the boundary's CRS first if the two do not
+    match.
+
+    Args:
+        raster: The raster to clip.
+        boundary: The study area boundary polygons.
+
+    Returns:
+        The clipped raster.
+    """
+    if raster.rio.crs != boundary.crs:
+        raster = raster.rio.reproject(boundary.crs)
+    # rio.clip accepts shapely geometries directly; converting each polygon
+    # to a GeoJSON dict with a pandas apply is per-row Python dispatch for
+    # a representation clip would immediately re-parse.
+    return raster.rio.clip(boundary.geometry.values, boundary.crs, drop=False)
+
+
+def raster_to_h3(src: rasterio.DatasetReader) -> pd.DataFrame:
+    """Aggregates raster pixel values into mean values per H3 cell.
+
+    The raster is streamed window by window along its native block layout,
+    so peak memory is bounded by the block size rather than the full band.
+    Per-cell partial sums and counts from each window are merged before the
+    means are taken, since a cell's pixels can span several windows.
+
+    Args:
+        src: An open single-band rasterio dataset with lat/lon coordinates.
+
+    Returns:
+        A DataFrame with "h3index" and "value" columns.
+    """
+    nodata = src.nodata
+    tile_cells = []
+    tile_sums = []
+    tile_counts = []
+    for _, window in src.block_windows(1):
+        data = src.read(1, window=window)
+        # data == data is False exactly for NaN, and the in-place &= drops
+        # one temporary mask allocation per window.
+        valid = data == data
+        valid &= data != nodata
+        if not valid.any():
+            continue
+        # The window transform already carries the window's offset, so the
+        # meshgrid stays in window-local indices.
+        a, b, c, d, e, f = src.window_transform(window)[:6]
+        cols, rows = np.meshgrid(
+            np.arange(data.shape[1]), np.arange(data.shape[0])
+        )
+        col_centers = cols + 0.5
+        row_centers = rows + 0.5
+        lons = a * col_centers + b * row_centers + c
+        lats = d * col_centers + e * row_centers + f
+        cells = np.fromiter(
+            (
+                h3.geo_to_h3(lat, lon, H3_RESOLUTION)
+                for lat, lon in zip(lats[valid], lons[valid])
+            ),
+            dtype=np.uint64,
+            count=int(valid.sum()),
+        )
+        unique_cells, inverse = np.unique(cells, return_inverse=True)
+        tile_cells.append(unique_cells)
+        tile_sums.append(np.bincount(inverse, weights=data[valid]))
+        tile_counts.append(np.bincount(inverse))
+
+    if tile_cells:
+        # Per-cell means via bincount over integer keys, matching groupby's
+        # sorted-by-cell output without materializing a sample DataFrame.
+        unique_cells, inverse = np.unique(
+            np.concatenate(tile_cells), return_inverse=True
+        )
+        sums = np.bincount(inverse, weights=np.concatenate(tile_sums))
+        counts = np.bincount(inverse, weights=np.concatenate(tile_counts))
+        means = sums / counts
+    else:
+        unique_cells, means = np.array([], dtype=np.uint64), np.array([])
+    # Cells are aggregated as integers; the published CSV keeps hex codes.
+    return pd.DataFrame(
+        {
+            "h3index": [h3.h3_to_string(cell) for cell in unique_cells],
+            "value": means,
+        }
+    )
+
+
+def _list_tif_paths(fs: gcsfs.GCSFileSystem, bucket_name: str, prefix: str) -> list[str]:
+    """Lists the GeoTIFF object paths under a prefix."""
+    return [
+        path
+        for path in fs.ls(f"{bucket_name}/{prefix}")
+        if path.endswith(".tif")
+    ]
+
+
+def _run_on_all_cores(worker, paths: list[str]) -> None:
+    """Maps a per-file worker over the paths on a process pool.
+
+    Files are independent, so the CPU-bound stages scale across cores while
+    each worker's GCS transfers overlap the others' compute.
+    """
+    if not paths:
+        return
+    workers = min(os.cpu_count() or 1, len(paths))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # list() drains the iterator so worker exceptions surface here.
+        list(pool.map(worker, paths))
+
+
+def _interpolate_and_clip_one(
+    path: str,
+    template_path: str,
+    boundary: gpd.GeoDataFrame,
+    output_prefix: str,
+) -> None:
+    """Interpolates and clips one raster; runs in a pool worker.
+
+    Fusing the two stages writes one compressed raster per input instead
+    of shipping an uncompressed intermediate through GCS and reading it
+    back for the clip.
+    """
+    fs = _get_gcs_fs()
+    bucket = _get_storage_client().bucket(OUTPUT_BUCKET_NAME)
+    template = _load_template(template_path)
+    # The input and output rasters both stay in memory; nothing round-trips
+    # through /tmp.
+    with MemoryFile(fs.cat(path)) as memory_in:
+        ds = rxr.open_rasterio(memory_in.name)
+        clipped = clip_raster_to_boundary(interp_out_grid(ds, template), boundary)
+        with MemoryFile() as memory_out:
+            # Horizontal differencing (predictor=2) makes LZW bite on the
+            # smoothly varying interpolated counts.
+            clipped.rio.to_raster(memory_out.name, compress="LZW", predictor=2)
+            blob_out = bucket.blob(f"{output_prefix}/{os.path.basename(path)}")
+            blob_out.upload_from_string(
+                memory_out.read(), content_type="image/tiff"
+            )
+
+
+def _convert_one_to_h3(path: str, output_prefix: str) -> None:
+    """Converts one raster to a per-H3-cell CSV; runs in a pool worker."""
+    fs = _get_gcs_fs()
+    # The raster stays in memory; nothing round-trips through /tmp.
+    with MemoryFile(fs.cat(path)) as memory_in:
+        with memory_in.open() as src:
+            h3_df = raster_to_h3(src)
+    csv_name = os.path.basename(path).replace(".tif", ".csv")
+    with fs.open(f"{OUTPUT_BUCKET_NAME}/{output_prefix}/{csv_name}", "w") as f:
+        h3_df.to_csv(f, index=False)
+
+
+def process_interpolate_and_clip_files(
+    fs: gcsfs.GCSFileSystem,
+    input_prefix: str,
+    template_path: str,
+    boundary: gpd.GeoDataFrame,
+    output_prefix: str,
+) -> None:
+    """Interpolates and clips every raster under the input prefix."""
+    # Warp the boundary polygons to the raster CRS once up front.
+    # Reprojecting the other way around means a full resample of every
+    # raster inside clip_raster_to_boundary, which is the single most
+    # expensive path in the clip.
+    template_crs = _load_template(template_path).rio.crs
+    if template_crs is not None and boundary.crs != template_crs:
+        boundary = boundary.to_crs(template_crs)
+    _run_on_all_cores(
+        functools.partial(
+            _interpolate_and_clip_one,
+            template_path=template_path,
+            boundary=boundary,
+            output_prefix=output_prefix,
+        ),
+        _list_tif_paths(fs, INPUT_BUCKET_NAME, input_prefix),
+    )
+
+
+def process_and_convert_to_h3(
+    fs: gcsfs.GCSFileSystem, input_prefix: str, output_prefix: str
+) -> None:
+    """Converts every clipped raster to a per-H3-cell mean CSV."""
+    _run_on_all_cores(
+        functools.partial(_convert_one_to_h3, output_prefix=output_prefix),
+        _list_tif_paths(fs, OUTPUT_BUCKET_NAME, input_prefix),
+    )
+
+
+def main() -> None:
+    fs = gcsfs.GCSFileSystem(project=GCP_PROJECT)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shp_path = download_shapefile(INPUT_BUCKET_NAME, BOUNDARY_PREFIX, tmp_dir)
+        boundary = gpd.read_file(shp_path)
+    process_interpolate_and_clip_files(
+        fs,
+        "rasters",
+        f"gs://{INPUT_BUCKET_NAME}/templates/output_grid.tif",
+        boundary,
+        "clipped",
+    )
+    process_and_convert_to_h3(fs, "clipped", "h3")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Converts heat rasters to H3 tables and merges them into one wide CSV.
+
+Each raster in the input folder is sampled to H3 cells and written out as a
+Parquet file of per-cell means; the per-raster files are then outer-joined
+on cell code into a single CSV table with one column per raster.
+
+Run as a standalone script; reads from and writes back to GCS.
+"""
+
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import gcsfs
+# The numpy_int API returns H3 indexes as unsigned integers, which keeps the
+# sampled cells in a numpy array instead of a list of hex strings.
+import h3.api.numpy_int as h3
+import numpy as np
+import pandas as pd
+from pyarrow import parquet as pq
+from rasterio.io import MemoryFile
+import rioxarray as rxr
+
+GCP_PROJECT = "climateiq"
+BUCKET_NAME = "climateiq-heat-output"
+RASTER_PREFIX = "clipped"
+PARQUET_PREFIX = "h3_parquet"
+MERGED_CSV_PATH = "merged/heat_h3.csv"
+H3_RESOLUTION = 10
+NUM_SAMPLES_PER_PIXEL_SIDE = 5
+
+# The filesystem is created lazily and cached per process, so pool workers
+# build their own connection instead of inheriting one that does not survive
+# the fork.
+_gcs_fs = None
+
+
+def _get_gcs_fs() -> gcsfs.GCSFileSystem:
+    """Returns a GCS filesystem shared within the current process."""
+    global _gcs_fs
+    if _gcs_fs is None:
+        _gcs_fs = gcsfs.GCSFileSystem(project=GCP_PROJECT)
+    return _gcs_fs
+
+
+def assign_pixels_to_h3(
+    pixels_df: pd.DataFrame,
+    pixel_size_x: float,
+    pixel_size_y: float,
+    resolution: int = H3_RESOLUTION,
+) -> pd.DataFrame:
+    """Assigns sampled points within each pixel to H3 cells.
+
+    Each pixel is covered by an evenly spaced grid of
+    NUM_SAMPLES_PER_PIXEL_SIDE**2 sample points, built by broadcasting the
+    per-pixel sample offsets over every pixel at once instead of iterating
+    rows and nesting a per-pixel sampling loop.
+
+    Args:
+        pixels_df: A DataFrame with "latitude", "longitude" and "value"
+            columns, one row per raster pixel.
+        pixel_size_x: The pixel width in degrees.
+        pixel_size_y: The pixel height in degrees.
+        resolution: The H3 resolution to assign cells at.
+
+    Returns:
+        A DataFrame with "cell_code" and "value" columns, one row per sample
+        point.
+    """
+    num_samples = NUM_SAMPLES_PER_PIXEL_SIDE
+    lat_offsets = -np.arange(num_samples) * pixel_size_y / num_samples
+    lon_offsets = np.arange(num_samples) * pixel_size_x / num_samples
+    sample_lats, sample_lons = np.broadcast_arrays(
+        pixels_df["latitude"].to_numpy()[:, None, None] + lat_offsets[:, None],
+        pixels_df["longitude"].to_numpy()[:, None, None] + lon_offsets[None, :],
+    )
+    cells = np.fromiter(
+        (
+            h3.geo_to_h3(lat, lon, resolution)
+            for lat, lon in zip(sample_lats.ravel(), sample_lons.ravel())
+        ),
+        dtype=np.uint64,
+        count=sample_lats.size,
+    )
+    return pd.DataFrame(
+        {
+            "cell_code": cells,
+            "value": np.repeat(
+                pixels_df["value"].to_numpy(), num_samples * num_samples
+            ),
+        }
+    )
+
+
+def raster_to_h3(raster_path: str) -> pd.DataFrame:
+    """Aggregates one raster into mean values per H3 cell.
+
+    Args:
+        raster_path: Path to a single-band GeoTIFF.
+
+    Returns:
+        A DataFrame with "cell_code" and "value" columns, one row per cell.
+    """
+    raster = rxr.open_rasterio(raster_path)
+    transform = raster.rio.transform()
+    nodata = raster.rio.nodata
+    data = raster.values[0]
+    # Apply the affine transform to every pixel center at once instead of
+    # looping over rows and columns in Python, with the six coefficients
+    # unpacked into plain float locals.
+    a, b, c, d, e, f = transform[:6]
+    cols, rows = np.meshgrid(np.arange(data.shape[1]), np.arange(data.shape[0]))
+    col_centers = cols + 0.5
+    row_centers = rows + 0.5
+    lons = a * col_centers + b * row_centers + c
+    lats = d * col_centers + e * row_centers + f
+    # data == data is False exactly for NaN, and the in-place &= drops one
+    # temporary mask allocation.
+    valid = data == data
+    valid &= data != nodata
+    pixels_df = pd.DataFrame(
+        {
+            "latitude": lats[valid],
+            "longitude": lons[valid],
+            "value": data[valid],
+        }
+    )
+
+    h3_df = assign_pixels_to_h3(pixels_df, transform[0], -transform[4])
+    # Per-cell means via bincount over integer keys, matching groupby's
+    # sorted-by-cell output without pandas' per-group state. The int32
+    # cast fixes the value dtype at write time, which is what the typed
+    # merge-stage parser expects.
+    unique_cells, inverse = np.unique(
+        h3_df["cell_code"].to_numpy(), return_inverse=True
+    )
+    sums = np.bincount(inverse, weights=h3_df["value"].to_numpy())
+    counts = np.bincount(inverse)
+    return pd.DataFrame(
+        {
+            # Cells are aggregated as integers; the published CSV keeps
+            # hex codes.
+            "cell_code": [h3.h3_to_string(cell) for cell in unique_cells],
+            "value": (sums / counts).astype(np.int32),
+        }
+    )
+
+
+def merge_h3_files(fs: gcsfs.GCSFileSystem, parquet_folder: str) -> pd.DataFrame:
+    """Outer-joins all per-raster H3 Parquet files on cell code.
+
+    Args:
+        fs: The GCS filesystem to read the files from.
+        parquet_folder: The folder containing the per-raster Parquet files.
+
+    Returns:
+        A DataFrame with one "cell_code" column and one value column per
+        input file.
+    """
+    paths = [
+        path for path in fs.ls(parquet_folder) if path.endswith(".parquet")
+    ]
+    # Each file contributes one cell-indexed column; a single concat then
+    # outer-joins them all at once. Merging into a growing frame instead
+    # would rebuild and rehash the whole table once per file. A one-file
+    # prefetch keeps the next download in flight while the current file
+    # decodes, so the GCS round-trips hide under the decode time.
+    columns = {}
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_future = prefetcher.submit(fs.cat, paths[0]) if paths else None
+        for i, path in enumerate(paths):
+            file_bytes = next_future.result()
+            if i + 1 < len(paths):
+                next_future = prefetcher.submit(fs.cat, paths[i + 1])
+            # Parquet carries the int32 schema from the conversion stage,
+            # so no text parsing or dtype fixing happens here.
+            table = pq.read_table(io.BytesIO(file_bytes))
+            column_name = os.path.basename(path).replace(".parquet", "")
+            columns[column_name] = (
+                table.to_pandas().set_index("cell_code")["value"]
+            )
+    if not columns:
+        return None
+    merged_df = pd.concat(columns, axis=1)
+    merged_df.index.name = "cell_code"
+    return merged_df.reset_index()
+
+
+def _convert_raster_to_parquet(path: str) -> None:
+    """Converts one raster to a per-H3-cell Parquet; runs in a pool worker."""
+    fs = _get_gcs_fs()
+    # The raster stays in memory; nothing round-trips through /tmp.
+    with MemoryFile(fs.cat(path)) as memory_file:
+        h3_df = raster_to_h3(memory_file.name)
+    parquet_name = os.path.basename(path).replace(".tif", ".parquet")
+    with fs.open(f"{BUCKET_NAME}/{PARQUET_PREFIX}/{parquet_name}", "wb") as f:
+        h3_df.to_parquet(f, engine="pyarrow", compression="zstd", index=False)
+
+
+def main() -> None:
+    fs = _get_gcs_fs()
+    raster_paths = [
+        path
+        for path in fs.ls(f"{BUCKET_NAME}/{RASTER_PREFIX}")
+        if path.endswith(".tif")
+    ]
+    # Rasters are independent, so convert them on all available cores; each
+    # worker's GCS transfers overlap the others' compute.
+    if raster_paths:
+        workers = min(os.cpu_count() or 1, len(raster_paths))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # list() drains the iterator so worker exceptions surface here.
+            list(pool.map(_convert_raster_to_parquet, raster_paths))
+
+    merged_df = merge_h3_files(fs, f"{BUCKET_NAME}/{PARQUET_PREFIX}")
+    with fs.open(f"{BUCKET_NAME}/{MERGED_CSV_PATH}", "w") as f:
+        merged_df.to_csv(f, index=False)
+
+
+if __name__ == "__main__":
+    main()